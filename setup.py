@@ -1,3 +1,30 @@
+import logging
+
 from setuptools import setup
+from setuptools.command.build_ext import build_ext
+
+
+class optional_build_ext(build_ext):
+    # the compiled parser module is optional: without a C compiler the pure Python module is installed
+    def run(self):
+        try:
+            build_ext.run(self)
+        except Exception as ex:
+            logging.warning("Could not compile the parser module, using the pure Python module: %s", ex)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except Exception as ex:
+            logging.warning("Could not compile %s, using the pure Python module: %s", ext.name, ex)
+
+
+try:
+    # optional: compile the parser module with Cython when it is available.
+    # Python imports the compiled extension in favour of the .py module.
+    from Cython.Build import cythonize
+    ext_modules = cythonize(["xml_to_json/convert_xml_to_json.py"], compiler_directives={"language_level": "3"}, quiet=True)
+except Exception:
+    ext_modules = []
 
-setup()
\ No newline at end of file
+setup(ext_modules=ext_modules, cmdclass={"build_ext": optional_build_ext})
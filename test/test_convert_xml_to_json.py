@@ -2,8 +2,12 @@ import unittest
 import json
 import os
 import tempfile
+import decimal
+from datetime import datetime
+from unittest import mock
 
-from xml_to_json.convert_xml_to_json import parse_file
+from xml_to_json import convert_xml_to_json
+from xml_to_json.convert_xml_to_json import parse_file, parse_file_parallel, json_decoder
 
 
 class MyTest(unittest.TestCase):
@@ -67,5 +71,314 @@ class MyTest(unittest.TestCase):
         print(target_json)
         self.assertEqual(target_json, test_json)
 
+    def test_excludepaths(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        input_file = os.path.join(realpath, "PurchaseOrder.xml")
+        output_file = os.path.join(tempfile.gettempdir(), "PurchaseOrder.excludepaths.jsonl")
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+        output_format = "jsonl"
+        zip = False
+        xpath = "/purchaseOrder/items/item"
+        attribpaths = None
+        excludepaths = "/purchaseOrder/items/item/comment"
+
+        test_json = list()
+        target_json = list()
+
+        parse_file(input_file, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths)
+        with open(os.path.join(realpath, "PurchaseOrder.jsonl")) as f:
+            for line in f:
+                record = json.loads(line)
+                record.pop("comment", None)
+                test_json.append(record)
+        with open(output_file) as f:
+            for line in f:
+                target_json.append(json.loads(line))
+        os.remove(output_file)
+
+        self.assertEqual(target_json, test_json)
+
+    def test_attribpaths(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        input_file = os.path.join(realpath, "PurchaseOrder.xml")
+        output_file = os.path.join(tempfile.gettempdir(), "PurchaseOrder.attribpaths.jsonl")
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+        output_format = "jsonl"
+        zip = False
+        xpath = "/purchaseOrder/items/item"
+        attribpaths = "/purchaseOrder,/purchaseOrder/items"
+        excludepaths = None
+
+        parse_file(input_file, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths)
+        with open(output_file) as f:
+            target_json = [json.loads(line) for line in f]
+        os.remove(output_file)
+
+        self.assertEqual(len(target_json), 2)
+        for record in target_json:
+            self.assertEqual(record["purchaseOrderorderDate"], "1999-10-20")
+        self.assertEqual(target_json[0]["itempartNum"], "872-AA")
+        self.assertEqual(target_json[1]["itempartNum"], "926-AA")
+
+    def test_simple_content(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        input_file = os.path.join(realpath, "PurchaseOrder.xml")
+        output_file = os.path.join(tempfile.gettempdir(), "PurchaseOrder.comment.jsonl")
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+        output_format = "jsonl"
+        zip = False
+        xpath = "/purchaseOrder/comment"
+        attribpaths = None
+        excludepaths = None
+
+        parse_file(input_file, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths)
+        with open(output_file) as f:
+            target_json = [json.loads(line) for line in f]
+        os.remove(output_file)
+
+        self.assertEqual(target_json, ["Hurry, my lawn is going wild!"])
+
+        xsd = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="root">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="price" maxOccurs="unbounded">
+          <xs:complexType>
+            <xs:simpleContent>
+              <xs:extension base="xs:decimal">
+                <xs:attribute name="currency" type="xs:string"/>
+              </xs:extension>
+            </xs:simpleContent>
+          </xs:complexType>
+        </xs:element>
+        <xs:element name="v" type="xs:integer" nillable="true" maxOccurs="unbounded"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+        xml = '<root xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><price currency="EUR">1.5</price><price>2</price><v>1</v><v xsi:nil="true"/><v>3</v></root>'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xsd_file = os.path.join(tmp_dir, "root.xsd")
+            input_file = os.path.join(tmp_dir, "root.xml")
+            output_file = os.path.join(tmp_dir, "root.jsonl")
+            with open(xsd_file, "w") as f:
+                f.write(xsd)
+            with open(input_file, "w") as f:
+                f.write(xml)
+
+            # attributes of simple content are kept
+            parse_file(input_file, output_file, xsd_file, "jsonl", False, "/root/price")
+            with open(output_file) as f:
+                target_json = [json.loads(line) for line in f]
+            self.assertEqual(target_json, [{"pricecurrency": "EUR", "price": 1.5}, {"price": 2.0}])
+
+            # nil elements are written as null
+            parse_file(input_file, output_file, xsd_file, "jsonl", False, "/root/v")
+            with open(output_file) as f:
+                target_json = [json.loads(line) for line in f]
+            self.assertEqual(target_json, [1, None, 3])
+
+    def test_target_namespace(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        with open(os.path.join(realpath, "PurchaseOrder.xsd")) as f:
+            xsd = f.read()
+        with open(os.path.join(realpath, "PurchaseOrder.xml")) as f:
+            xml = f.read()
+
+        # the target namespace is not the default namespace of the schema
+        xsd = xsd.replace('elementFormDefault="qualified"', 'targetNamespace="urn:po" xmlns:po="urn:po" elementFormDefault="qualified"')
+        for name in ["PurchaseOrderType", "USAddress", "Items", "SKU", "comment"]:
+            xsd = xsd.replace('type="' + name + '"', 'type="po:' + name + '"').replace('ref="' + name + '"', 'ref="po:' + name + '"')
+        xml = xml.replace("<purchaseOrder ", '<purchaseOrder xmlns="urn:po" ')
+
+        with open(os.path.join(realpath, "PurchaseOrder.jsonl")) as f:
+            test_json = [json.loads(line) for line in f]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xsd_file = os.path.join(tmp_dir, "PurchaseOrder.xsd")
+            input_file = os.path.join(tmp_dir, "PurchaseOrder.xml")
+            output_file = os.path.join(tmp_dir, "PurchaseOrder.jsonl")
+            with open(xsd_file, "w") as f:
+                f.write(xsd)
+            with open(input_file, "w") as f:
+                f.write(xml)
+
+            parse_file(input_file, output_file, xsd_file, "jsonl", False, "/purchaseOrder/items/item")
+            with open(output_file) as f:
+                target_json = [json.loads(line) for line in f]
+            self.assertEqual(target_json, test_json)
+
+            parse_file(input_file, output_file, xsd_file, "jsonl", False, "/purchaseOrder/items/item", "/purchaseOrder")
+            with open(output_file) as f:
+                target_json = [json.loads(line) for line in f]
+            self.assertEqual(target_json, [{"purchaseOrderorderDate": "1999-10-20", **record} for record in test_json])
+
+            with self.assertRaises(ValueError):
+                parse_file(input_file, output_file, xsd_file, "jsonl", False, "/purchaseOrder/items/unknown")
+
+    def test_external_entity(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+
+        with open(os.path.join(realpath, "PurchaseOrder.xml")) as f:
+            xml = f.read()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            secret_file = os.path.join(tmp_dir, "secret.txt")
+            input_file = os.path.join(tmp_dir, "PurchaseOrder.xml")
+            output_file = os.path.join(tmp_dir, "PurchaseOrder.jsonl")
+            with open(secret_file, "w") as f:
+                f.write("secret")
+            with open(input_file, "w") as f:
+                f.write(xml.replace('<?xml version="1.0"?>', '<?xml version="1.0"?>\n<!DOCTYPE purchaseOrder [<!ENTITY secret SYSTEM "file://' + secret_file + '">]>')
+                        .replace("Confirm this is electric", "&secret;"))
+
+            parse_file(input_file, output_file, xsd_file, "jsonl", False, "/purchaseOrder/items/item")
+            with open(output_file) as f:
+                target_json = f.read()
+
+        self.assertNotIn("secret", target_json)
+
+    def test_parallel(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+        xpath = "/purchaseOrder/items/item"
+
+        with open(os.path.join(realpath, "PurchaseOrder.xml")) as f:
+            xml = f.read()
+        items_start = xml.index("<items>") + len("<items>")
+        items_end = xml.index("</items>")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "PurchaseOrder.xml")
+            with open(input_file, "w") as f:
+                f.write(xml[:items_start] + xml[items_start:items_end] * 100 + xml[items_end:])
+
+            for output_format in ("json", "jsonl"):
+                test_file = os.path.join(tmp_dir, "test." + output_format)
+                target_file = os.path.join(tmp_dir, "target." + output_format)
+
+                parse_file(input_file, test_file, xsd_file, output_format, False, xpath)
+                with mock.patch.object(convert_xml_to_json, "_MIN_PARTITION_SIZE", 0):
+                    parse_file_parallel(input_file, target_file, xsd_file, output_format, False, xpath, multi=3)
+
+                with open(test_file) as f:
+                    test_json = f.read()
+                with open(target_file) as f:
+                    target_json = f.read()
+                self.assertEqual(target_json, test_json)
+
+    def test_multi_with_error(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+
+        with open(os.path.join(realpath, "PurchaseOrder.xml")) as f:
+            xml = f.read()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i in range(24):
+                with open(os.path.join(tmp_dir, str(i) + ".xml"), "w") as f:
+                    f.write(xml)
+            with open(os.path.join(tmp_dir, "broken.xml"), "w") as f:
+                f.write(xml[:300])
+
+            convert_xml_to_json.convert_xml_to_json(xsd_file, "jsonl", multi=2, verbose="CRITICAL", xml_files=[os.path.join(tmp_dir, "*.xml")])
+
+            for i in range(24):
+                self.assertTrue(os.path.isfile(os.path.join(tmp_dir, str(i) + ".jsonl")))
+
+    def test_parallel_with_error(self):
+
+        realpath = os.path.dirname(os.path.realpath(__file__))
+
+        xsd_file = os.path.join(realpath, "PurchaseOrder.xsd")
+
+        with open(os.path.join(realpath, "PurchaseOrder.xml")) as f:
+            xml = f.read()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "broken.xml")
+            with open(input_file, "w") as f:
+                f.write(xml[:300])
+            valid_file = os.path.join(tmp_dir, "valid.xml")
+            with open(valid_file, "w") as f:
+                items_start = xml.index("<items>") + len("<items>")
+                items_end = xml.index("</items>")
+                f.write(xml[:items_start] + xml[items_start:items_end] * 100 + xml[items_end:])
+
+            with mock.patch.object(convert_xml_to_json, "_MIN_PARTITION_SIZE", 0):
+                # a single file is parsed through parse_file_parallel, with and without partitions, errors are logged
+                for xpath in [None, "/purchaseOrder/items/item"]:
+                    with self.assertLogs(convert_xml_to_json._logger, "INFO") as logs:
+                        convert_xml_to_json.convert_xml_to_json(xsd_file, "jsonl", xpath=xpath, multi=2, verbose="CRITICAL", xml_files=[input_file])
+                    self.assertTrue(any(input_file + ": " in line for line in logs.output))
+
+                # the xsd element of xpath is resolved before the file is split
+                with mock.patch.object(convert_xml_to_json, "find_xsd_elem", return_value=None):
+                    with self.assertLogs(convert_xml_to_json._logger, "INFO") as logs:
+                        convert_xml_to_json.convert_xml_to_json(xsd_file, "json", xpath="/purchaseOrder/items/item", multi=2, verbose="CRITICAL", xml_files=[valid_file])
+                    self.assertTrue(any(valid_file + ": " in line for line in logs.output))
+
+            # no incomplete output or partitions are left
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["broken.xml", "valid.xml"])
+
+    def test_large_integer(self):
+
+        xsd = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="orders">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="order" maxOccurs="unbounded">
+          <xs:complexType>
+            <xs:sequence>
+              <xs:element name="id" type="xs:integer"/>
+              <xs:element name="name" type="xs:string"/>
+            </xs:sequence>
+          </xs:complexType>
+        </xs:element>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+        xml = "<orders><order><id>123456789012345678901234</id><name>big</name></order><order><id>1</id><name>small</name></order></orders>"
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xsd_file = os.path.join(tmp_dir, "orders.xsd")
+            input_file = os.path.join(tmp_dir, "orders.xml")
+            output_file = os.path.join(tmp_dir, "orders.jsonl")
+            with open(xsd_file, "w") as f:
+                f.write(xsd)
+            with open(input_file, "w") as f:
+                f.write(xml)
+
+            parse_file(input_file, output_file, xsd_file, "jsonl", False, "/orders/order")
+            with open(output_file) as f:
+                target_json = [json.loads(line) for line in f]
+
+        self.assertEqual(target_json, [{"id": 123456789012345678901234, "name": "big"}, {"id": 1, "name": "small"}])
+
+    def test_json_decoder(self):
+
+        self.assertEqual(json_decoder(decimal.Decimal("148.95")), 148.95)
+        self.assertEqual(json_decoder(datetime(1999, 10, 20, 12, 30)), "1999-10-20 12:30:00.000000")
+        self.assertEqual(json_decoder({1}), [1])
+        with self.assertRaises(TypeError):
+            json_decoder(object())
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -13,7 +13,7 @@ def run():
     parser.add_argument("-o", "--output_format", default="jsonl", help="output format json or jsonl. Default is jsonl.")
     parser.add_argument("-s", "--server", help="server with hadoop client installed if hadoop not installed")
     parser.add_argument("-t", "--target_path", help="target path. hdfs targets require hadoop client installation. Examples: /proj/test, hdfs:///proj/test, hdfs://halfarm/proj/test")
-    parser.add_argument("-z", "--zip", action="store_true", help="gzip output file")
+    parser.add_argument("-z", "--zip", action="store_true", help="gzip output file (compression level 1)")
     parser.add_argument("-p", "--xpath", help="xpath to parse out.")
     parser.add_argument("-a", "--attribpaths", help="extra element attributes to parse out.")
     parser.add_argument("-e", "--excludepaths", help="elements to exclude. pass in comma separated string. /path/exclude1,/path/exclude2")
@@ -3,11 +3,16 @@
 
 Author: David Lee
 """
-import xml.etree.cElementTree as ET
+from lxml import etree as ET
 import xmlschema
 from collections import OrderedDict
 import decimal
+import functools
+from datetime import datetime
 import json
+import mmap
+import re
+import io
 import glob
 from multiprocessing import Pool
 import subprocess
@@ -17,15 +22,64 @@ import tarfile
 import logging
 import shutil
 import sys
+import tempfile
 from zipfile import ZipFile
 # import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from xmlschema.exceptions import XMLSchemaValueError
 from xmlschema.compat import ordered_dict_class
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
+# compiled schemas by xsd file path and modification time
+_SCHEMA_CACHE = dict()
+
+# pre-encoded output separators
+_SEP_JSON = ("," + os.linesep).encode("utf-8")
+_SEP_JSONL = os.linesep.encode("utf-8")
+_JSON_ARRAY_START = ("[" + os.linesep).encode("utf-8")
+_JSON_ARRAY_END = (os.linesep + "]").encode("utf-8")
+
+# write buffer size of output files
+_BUFFER_SIZE = 1 << 20
+
+# gzip level of zipped output files, fastest compression at slightly larger size
+_GZIP_COMPRESSLEVEL = 1
+
+# max. size of archive members to keep in memory while parsing
+_MAX_MEMBER_BUFFER_SIZE = 256 << 20
+
+# min. size of a single xml file to split it into partitions parsed concurrently
+_MIN_PARTITION_SIZE = 64 << 20
+
+# max. number of files logged from the head and tail of the file order
+_LOG_FILE_LIST_SIZE = 10
+
+# pool workers are recycled after this many tasks to release leaked memory
+_MAX_TASKS_PER_CHILD = 50
+
+
+def _datetime_to_str(obj):
+    """
+    :param obj: datetime
+    :return: formatted datetime string
+    """
+    return obj.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+# converters of types json can't encode
+_JSON_ENCODERS = {
+    decimal.Decimal: float,
+    datetime: _datetime_to_str,
+    set: list,
+}
+
 
 def json_decoder(obj):
     """
@@ -33,27 +87,70 @@ def json_decoder(obj):
     :return: converted type
     :raises:
     """
-    if isinstance(obj, decimal.Decimal):
-        return float(obj)
-    if isinstance(obj, datetime):
-        return obj.strftime('%Y-%m-%d %H:%M:%S.%f')
-    if isinstance(obj, set):
-        return list(obj)
+    encoder = _JSON_ENCODERS.get(type(obj))
+    if encoder is not None:
+        return encoder(obj)
+    for obj_type, encoder in _JSON_ENCODERS.items():
+        if isinstance(obj, obj_type):
+            return encoder(obj)
     raise TypeError(repr(obj) + " is not JSON serializable")
 
 
-def nested_get(nested_dict, keys):
+def json_dumps(obj):
     """
-    :param nested_dict: dictionary
-    :param keys: list of keys
-    :return: return back object
+    :param obj: python data
+    :return: utf-8 encoded json, using orjson if available
     """
-    for key in keys:
-        if isinstance(nested_dict, list):
-            nested_dict = nested_dict[0][key]
-        else:
-            nested_dict = nested_dict[key]
-    return nested_dict
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=json_decoder)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bit, which only json supports
+            pass
+    return json.dumps(obj, default=json_decoder).encode("utf-8")
+
+
+def path_id(parent_id, tag):
+    """
+    :param parent_id: path id of the parent element, 0 for root
+    :param tag: local name of the element
+    :return: hash based id of the element path
+    """
+    return hash((parent_id, tag))
+
+
+def xpath_id(xpath_key):
+    """
+    :param xpath_key: xpath in tuple format
+    :return: path id of the xpath
+    """
+    xpath_hash = 0
+    for tag in xpath_key:
+        xpath_hash = path_id(xpath_hash, tag)
+    return xpath_hash
+
+
+def decode_elem(xsd_elem, elem, namespaces, is_simple):
+    """
+    :param xsd_elem: xmlschema element of elem
+    :param elem: xml element
+    :param namespaces: map from namespace prefixes to URI
+    :param is_simple: xsd_elem has a simple type or simple content
+    :return: decoded data of elem as it would appear within its parent
+    """
+    if is_simple:
+        # skip the converter, build the record as ParqConverter does: the text, or the prefixed attributes and the text
+        data = xsd_elem.decode(elem, converter=None, validation='skip', namespaces=namespaces)
+        if data is None:
+            # nil elements decode to nothing
+            return None
+        value = data.text if data.text is not None and data.text != "" else None
+        if not xsd_elem.attributes:
+            return value
+        my_dict = {xsd_elem.local_name + name: attrib_value for name, attrib_value in data.attributes or ()}
+        my_dict[xsd_elem.local_name] = value
+        return my_dict
+    return xsd_elem.decode(elem, converter=ParqConverter, validation='skip', process_namespaces=False, namespaces=namespaces)[xsd_elem.local_name]
 
 
 class ParqConverter(xmlschema.XMLSchemaConverter):
@@ -105,6 +202,8 @@ class ParqConverter(xmlschema.XMLSchemaConverter):
             result_dict[xsd_element.local_name] = data.text if data.text is not None and data.text != "" else None
 
         if data.content:
+            # computed on first use, see below
+            single_child_parent = None
             for name, value, xsd_child in self.map_content(data.content):
                 if value:
                     if xsd_child.local_name:
@@ -112,32 +211,34 @@ class ParqConverter(xmlschema.XMLSchemaConverter):
                     else:
                         name = name[2 + len(xsd_child.namespace):]
 
+                    is_simple = hasattr(xsd_child, 'type') and (xsd_child.type.is_simple() or xsd_child.type.has_simple_content())
                     if xsd_child.is_single():
-                        if hasattr(xsd_child, 'type') and (xsd_child.type.is_simple() or xsd_child.type.has_simple_content()):
+                        if is_simple:
                             for k in value:
                                 result_dict[k] = value[k]
                         else:
                             result_dict[name] = value
                     else:
-                        if (xsd_child.type.is_simple() or xsd_child.type.has_simple_content()) and not xsd_child.attributes:
-                            if len(xsd_element.findall("*")) == 1:
-                                try:
-                                    result_dict.append(list(value.values())[0])
-                                except AttributeError:
-                                    result_dict = self.list(value.values())
+                        if is_simple and not xsd_child.attributes:
+                            values = value.values()
+                            if single_child_parent is None:
+                                single_child_parent = len(list(xsd_element)) == 1
+                            if single_child_parent:
+                                if isinstance(result_dict, list):
+                                    result_dict.append(next(iter(values)))
+                                else:
+                                    result_dict = self.list(values)
                             else:
-                                try:
-                                    result_dict[name].append(list(value.values())[0])
-                                except KeyError:
-                                    result_dict[name] = self.list(value.values())
-                                except AttributeError:
-                                    result_dict[name] = self.list(value.values())
+                                existing = result_dict.get(name)
+                                if isinstance(existing, list):
+                                    existing.append(next(iter(values)))
+                                else:
+                                    result_dict[name] = self.list(values)
                         else:
-                            try:
-                                result_dict[name].append(value)
-                            except KeyError:
-                                result_dict[name] = self.list([value])
-                            except AttributeError:
+                            existing = result_dict.get(name)
+                            if isinstance(existing, list):
+                                existing.append(value)
+                            else:
                                 result_dict[name] = self.list([value])
         if level == 0:
             return self.dict([(xsd_element.local_name, result_dict)])
@@ -145,6 +246,89 @@ class ParqConverter(xmlschema.XMLSchemaConverter):
             return result_dict
 
 
+def get_schema(xsd_file):
+    """
+    :param xsd_file: xsd file
+    :return: xmlschema object, compiled once per xsd file and process
+    """
+    key = (os.path.realpath(xsd_file), os.path.getmtime(xsd_file))
+    if key not in _SCHEMA_CACHE:
+        _logger.debug("Generating schema from " + xsd_file)
+        _SCHEMA_CACHE[key] = xmlschema.XMLSchema(xsd_file, converter=ParqConverter)
+    return _SCHEMA_CACHE[key]
+
+
+@functools.lru_cache(maxsize=128)
+def find_xsd_elem(my_schema, xpath):
+    """
+    :param my_schema: xmlschema object
+    :param xpath: xpath of the element
+    :return: xmlschema element of xpath, resolved once per schema and xpath
+    """
+    # xml elements are matched by local name, so are the xsd elements: xpaths are not namespace qualified
+    xsd_elem = None
+    for tag in xpath.split("/")[1:]:
+        if xsd_elem is None:
+            xsd_elem = my_schema.elements.get(tag)
+            if xsd_elem is None:
+                xsd_elem = next((e for e in my_schema.maps.elements.values() if e.local_name == tag), None)
+        else:
+            xsd_elem = next((e for e in xsd_elem if e.local_name == tag), None)
+        if xsd_elem is None:
+            return None
+    return xsd_elem
+
+
+def _init_worker(xsd_file):
+    """
+    :param xsd_file: xsd file to compile once when a pool worker starts
+    """
+    get_schema(xsd_file)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_paths(xpath, attribpaths, excludepaths):
+    """
+    :param xpath: xpath to parse out
+    :param attribpaths: comma separated paths to capture attributes when used with xpath
+    :param excludepaths: comma separated paths to exclude
+    :return: xpath, attribpaths, excludepaths and parent paths of excludes in tuple format
+    """
+    xpath_key = None
+    attribpaths_keys = tuple()
+    excludepaths_set = frozenset()
+    excludeparents_set = frozenset()
+
+    if excludepaths:
+        excludepaths_list = [tuple(v.split("/")[1:]) for v in excludepaths.split(",")]
+        excludepaths_set = frozenset(excludepaths_list)
+        excludeparents_set = frozenset(v[:-1] for v in excludepaths_list)
+
+    if xpath:
+        xpath_key = tuple(xpath.split("/")[1:])
+
+        if attribpaths:
+            attribpaths_keys = tuple(k for k in dict.fromkeys(tuple(v.split("/")[1:]) for v in attribpaths.split(",")) if k != xpath_key)
+
+    return xpath_key, attribpaths_keys, excludepaths_set, excludeparents_set
+
+
+def _parse_file_star(args):
+    """
+    :param args: tuple of parse_file arguments
+    :return: error message if the file could not be converted, otherwise None
+    """
+    try:
+        parse_file(*args)
+    except Exception as ex:
+        # remove the incomplete output of the file
+        output_file = args[1]
+        if output_file != '-' and os.path.isfile(output_file):
+            os.remove(output_file)
+        # errors are returned as text, lxml errors can't be pickled back to the parent process
+        return args[0] + ": " + str(ex)
+
+
 def open_file(zip, filename):
     """
     :param zip: whether to open a new file using gzip
@@ -154,55 +338,56 @@ def open_file(zip, filename):
     if filename == '-':
         if zip:
             raise ValueError("zip is not supported from stdin")
-        return os.fdopen(sys.stdout.fileno(), "wb")
+        return os.fdopen(sys.stdout.fileno(), "wb", buffering=_BUFFER_SIZE)
     if zip:
-        return gzip.open(filename, "wb")
+        return io.BufferedWriter(gzip.open(filename, "wb", compresslevel=_GZIP_COMPRESSLEVEL), buffer_size=_BUFFER_SIZE)
     else:
-        return open(filename, "wb")
+        return open(filename, "wb", buffering=_BUFFER_SIZE)
 
 
 def parse_root(xml_file, parent_xpath_list):
     """
     :param xml_file: xml file
     :param parent_xpath_list: xpath of parent
-    :return: root and parent for xml snippet
+    :return: whether the xml file contains the parent path
     """
-    parent = None
+    has_parent_path = False
     currentxpath = []
 
-    context = ET.iterparse(xml_file, events=("start", "end"))
+    # compare depth and last tag before comparing the whole path
+    target_depth = len(parent_xpath_list)
+    target_last = parent_xpath_list[-1] if parent_xpath_list else None
+
+    context = ET.iterparse(xml_file, events=("start", "end"), huge_tree=True, resolve_entities=False)
     event, root = next(context)
-    currentxpath.append(root.tag.split('}', 1)[-1])
+    currentxpath.append(root.tag.rpartition('}')[2])
     if currentxpath == parent_xpath_list:
-        root.clear()
-        parent = root
+        has_parent_path = True
     else:
         for event, elem in context:
             if event == "start":
-                currentxpath.append(elem.tag.split('}', 1)[-1])
-                if currentxpath == parent_xpath_list:
-                    elem.clear()
-                    parent = elem
+                currentxpath.append(elem.tag.rpartition('}')[2])
+                if len(currentxpath) == target_depth and currentxpath[-1] == target_last and currentxpath == parent_xpath_list:
+                    has_parent_path = True
                     break
             if event == "end":
                 elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
                 del currentxpath[-1]
-    if parent is None:
-        root = None
     del context
-    return (root, parent)
+    return has_parent_path
 
 
-def parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip):
+def parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip):
     """
     :param xml_file: xml file
     :param json_file: json file
     :param my_schema: xmlschema object
     :param output_format: jsonl or json
     :param xpath_list: xpath in array format
-    :param root: xml root
-    :param parent: xml_parent
-    :param attribpaths_dict: captured parent root elements for attributes
+    :param xsd_elem: xmlschema element of xpath
+    :param attribpaths_dict: captured attributes of parent elements
     :param excludepaths_set: paths to exclude
     :param excludeparents_set: parent paths of excludes
     :param elem_active: keep or clear elem
@@ -214,93 +399,127 @@ def parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, p
     is_array = False
     excludeparent = None
     currentxpath = []
+    simple_xpath = xsd_elem is not None and (xsd_elem.type.is_simple() or xsd_elem.type.has_simple_content())
+    # records are written together with their separator in a single write
+    record_sep = _SEP_JSON if output_format == "json" else _SEP_JSONL
 
-    context = ET.iterparse(xml_file, events=("start", "end"))
-    # Parse XML
-    for event, elem in context:
-        if event == "start":
-            currentxpath.append(elem.tag.split('}', 1)[-1])
-            if currentxpath == xpath_list:
-                elem_active = True
+    # track element paths by hash ids; tuples are only built on a hash hit
+    has_paths = bool(attribpaths_dict or excludepaths_set or excludeparents_set)
+    attribpaths_ids = {xpath_id(k): k for k in attribpaths_dict}
+    excludepaths_ids = {xpath_id(k): k for k in excludepaths_set}
+    excludeparents_ids = {xpath_id(k): k for k in excludeparents_set}
+    currentpath_ids = [0]
+
+    # local names by namespaced tag, xml documents only use a few distinct tags
+    localnames = dict()
 
-            currentxpath_key = tuple(currentxpath)
+    def process_elem(elem):
+        """
+        :param elem: xml element matching xpath
+        """
+        nonlocal processed, is_array
+        try:
+            my_dict = decode_elem(xsd_elem, elem, my_schema.namespaces, simple_xpath)
+            is_array = not xsd_elem.is_single()
+            if len(attribpaths_dict) > 0:
+                attrib_dict = dict()
+                for dict_value in attribpaths_dict.values():
+                    if dict_value['attributes']:
+                        attrib_dict.update(dict_value['attributes'])
+                my_dict = {**attrib_dict, **my_dict}
 
-            if currentxpath_key in attribpaths_dict:
-                new_elem = ET.Element(elem.tag)
-                new_elem.attrib = elem.attrib
+            my_json = json_dumps(my_dict)
 
-                if attribpaths_dict[currentxpath_key]['root'] is None:
-                    attribpaths_dict[currentxpath_key]['attributes'] = nested_get(my_schema.to_dict(new_elem, process_namespaces=False, validation='skip'), currentxpath)
+            if not processed:
+                processed = True
+                if is_array and output_format == "json" and not from_zip:
+                    json_file.write(_JSON_ARRAY_START + my_json)
                 else:
-                    attribpaths_dict[currentxpath_key]['parent'].append(new_elem)
-                    attribpaths_dict[currentxpath_key]['attributes'] = nested_get(my_schema.to_dict(attribpaths_dict[currentxpath_key]['root'], process_namespaces=False, validation='skip'), currentxpath)
-                    attribpaths_dict[currentxpath_key]['parent'].remove(new_elem)
-                if isinstance(attribpaths_dict[currentxpath_key]['attributes'], list):
-                    attribpaths_dict[currentxpath_key]['attributes'] = attribpaths_dict[currentxpath_key]['attributes'][0]
-
-            if currentxpath_key in excludeparents_set:
-                excludeparent = elem
-
-        if event == "end":
-            if currentxpath == xpath_list:
-                parent.append(elem)
-                try:
-                    my_dict = nested_get(my_schema.to_dict(root, process_namespaces=False, validation='skip'), xpath_list)
-                    if isinstance(my_dict, list):
-                        is_array = True
-                        my_dict = my_dict[0]
-                    if len(attribpaths_dict) > 0:
-                        attrib_dict = dict()
-                        for dict_value in attribpaths_dict.values():
-                            if dict_value['attributes']:
-                                attrib_dict.update(dict_value['attributes'])
-                        my_dict = {**attrib_dict, **my_dict}
-
-                    my_json = json.dumps(my_dict, default=json_decoder)
-
-                    if not processed:
-                        processed = True
-                        if is_array and output_format == "json" and not from_zip:
-                            json_file.write(bytes("[" + os.linesep, "utf-8"))
-                        json_file.write(bytes(my_json, "utf-8"))
-                    else:
-                        if output_format == "json":
-                            json_file.write(bytes("," + os.linesep + my_json, "utf-8"))
-                        else:
-                            json_file.write(bytes(os.linesep + my_json, "utf-8"))
-                except Exception as ex:
-                    _logger.debug(ex)
-                    pass
-                parent.remove(elem)
-            if not elem_active:
-                elem.clear()
+                    json_file.write(my_json)
+            else:
+                json_file.write(record_sep + my_json)
+        except Exception as ex:
+            _logger.debug(ex)
+            pass
+
+    # entities are never resolved: external entities could read local files into the output
+    context = ET.iterparse(xml_file, events=("start", "end"), huge_tree=True, resolve_entities=False)
+    # Parse XML
+    if has_paths:
+        for event, elem in context:
+            if event == "start":
+                tag = elem.tag
+                localname = localnames.get(tag)
+                if localname is None:
+                    localname = localnames[tag] = tag.rpartition('}')[2]
+                currentxpath.append(localname)
+                if currentxpath == xpath_list:
+                    elem_active = True
 
-            currentxpath_key = tuple(currentxpath)
+                currentpath_id = path_id(currentpath_ids[-1], currentxpath[-1])
+                currentpath_ids.append(currentpath_id)
 
-            if currentxpath_key in excludepaths_set:
-                excludeparent.remove(elem)
+                if currentpath_id in attribpaths_ids and attribpaths_ids[currentpath_id] == tuple(currentxpath):
+                    new_elem = ET.Element(elem.tag, elem.attrib)
+
+                    attrib_value = attribpaths_dict[attribpaths_ids[currentpath_id]]
+                    attrib_value['attributes'] = attrib_value['xsd_elem'].decode(new_elem, converter=ParqConverter, validation='skip', process_namespaces=False, namespaces=my_schema.namespaces)[attrib_value['xsd_elem'].local_name]
+
+                if currentpath_id in excludeparents_ids and excludeparents_ids[currentpath_id] == tuple(currentxpath):
+                    excludeparent = elem
+
+            if event == "end":
+                if currentxpath == xpath_list:
+                    process_elem(elem)
+                    elem_active = False
+                if not elem_active:
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+
+                currentpath_id = currentpath_ids.pop()
+                if currentpath_id in excludepaths_ids and excludepaths_ids[currentpath_id] == tuple(currentxpath):
+                    excludeparent.remove(elem)
+
+                del currentxpath[-1]
+    else:
+        # no attribute or exclude paths, only track the current xpath
+        for event, elem in context:
+            if event == "start":
+                tag = elem.tag
+                localname = localnames.get(tag)
+                if localname is None:
+                    localname = localnames[tag] = tag.rpartition('}')[2]
+                currentxpath.append(localname)
+                if currentxpath == xpath_list:
+                    elem_active = True
+            else:
+                if currentxpath == xpath_list:
+                    process_elem(elem)
+                    elem_active = False
+                if not elem_active:
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
 
-            del currentxpath[-1]
+                del currentxpath[-1]
 
     if xpath_list:
         if is_array and output_format == "json" and not from_zip:
-            json_file.write(bytes(os.linesep + "]", "utf-8"))
+            json_file.write(_JSON_ARRAY_END)
     else:
         my_dict = my_schema.to_dict(elem, process_namespaces=False, validation='skip')
         try:
-            my_json = json.dumps(my_dict, default=json_decoder)
+            my_json = json_dumps(my_dict)
         except Exception as ex:
             _logger.debug(ex)
             pass
         if len(my_json) > 0:
             if not processed:
                 processed = True
-                json_file.write(bytes(my_json, "utf-8"))
+                json_file.write(my_json)
             else:
-                if output_format == "json":
-                    json_file.write(bytes("," + os.linesep + my_json, "utf-8"))
-                else:
-                    json_file.write(bytes(os.linesep + my_json, "utf-8"))
+                json_file.write(record_sep + my_json)
 
     del context
     return processed
@@ -321,36 +540,25 @@ def parse_file(input_file, output_file, xsd_file, output_format, zip, xpath=None
     :param delete_xml: optional delete xml file after converting
     """
 
-    _logger.debug("Generating schema from " + xsd_file)
-
-    my_schema = xmlschema.XMLSchema(xsd_file, converter=ParqConverter)
+    my_schema = get_schema(xsd_file)
 
     _logger.debug("Parsing " + input_file)
 
     _logger.debug("Writing to file " + output_file)
 
+    xpath_key, attribpaths_keys, excludepaths_set, excludeparents_set = parse_paths(xpath, attribpaths, excludepaths)
     xpath_list = None
+    xsd_elem = None
     attribpaths_dict = dict()
-    excludepaths_set = set()
-    excludeparents_set = set()
-
-    if excludepaths:
-        excludepaths = excludepaths.split(",")
-        excludepaths_list = [v.split("/")[1:] for v in excludepaths]
-        excludepaths_set = {tuple(v) for v in excludepaths_list}
-        excludeparents_set = {tuple(v[:-1]) for v in excludepaths_list}
-
-    if xpath:
-        xpath_list = xpath.split("/")[1:]
-
-        if attribpaths:
-            attribpaths_list = [v.split("/")[1:] for v in attribpaths.split(",")]
-            attribpaths_dict = {tuple(v): {"root": None, "parent": None, "attributes": {}} for v in attribpaths_list}
-
-        if tuple(xpath_list) in attribpaths_dict:
-            del(attribpaths_dict[tuple(xpath_list)])
 
-        xsd_elem = my_schema.find(xpath, namespaces=my_schema.namespaces)
+    if xpath_key:
+        xpath_list = list(xpath_key)
+        attribpaths_dict = {k: {"xsd_elem": find_xsd_elem(my_schema, "/" + "/".join(k)), "attributes": {}} for k in attribpaths_keys}
+        xsd_elem = find_xsd_elem(my_schema, xpath)
+        # records are decoded with the xsd element, without it every record would be dropped
+        for path, xsd_path_elem in [(xpath, xsd_elem)] + [("/" + "/".join(k), v["xsd_elem"]) for k, v in attribpaths_dict.items()]:
+            if xsd_path_elem is None:
+                raise ValueError(path + " not found in " + xsd_file)
         elem_active = False
     else:
         elem_active = True
@@ -359,11 +567,10 @@ def parse_file(input_file, output_file, xsd_file, output_format, zip, xpath=None
 
     with open_file(zip, output_file) as json_file:
 
-        root = None
-        parent = None
+        has_parent_path = False
 
         if input_file.endswith((".zip", ".tar.gz")) and output_format == "json":
-            json_file.write(bytes("[" + os.linesep, "utf-8"))
+            json_file.write(_JSON_ARRAY_START)
 
         if input_file.endswith(".tar.gz"):
             zip_file = tarfile.open(input_file, 'r')
@@ -371,24 +578,29 @@ def parse_file(input_file, output_file, xsd_file, output_format, zip, xpath=None
 
             for member in zip_file_list:
                 if xpath_list:
-                    if root is None:
+                    member_buffer = None
+                    if not has_parent_path:
                         parent_xpath_list = xpath_list[:-1]
                         with zip_file.extractfile(member) as xml_file:
-                            root, parent = parse_root(xml_file, parent_xpath_list)
-                    if root is not None:
-                        if attribpaths:
-                            for k, v in attribpaths_dict.items():
-                                attribpaths_dict[k]['attributes'] = {}
-                                if v['root'] is None:
-                                    parent_xpath_list = list(k)[:-1]
-                                    with zip_file.extractfile(member) as xml_file:
-                                        attribpaths_dict[k]['root'], attribpaths_dict[k]['parent'] = parse_root(xml_file, parent_xpath_list)
-
-                        with zip_file.extractfile(member) as xml_file:
-                            processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
+                            if member.size <= _MAX_MEMBER_BUFFER_SIZE:
+                                # decompress the member only once for parse_root and parse_xml
+                                member_buffer = io.BytesIO(xml_file.read())
+                                has_parent_path = parse_root(member_buffer, parent_xpath_list)
+                            else:
+                                has_parent_path = parse_root(xml_file, parent_xpath_list)
+                    if has_parent_path:
+                        for v in attribpaths_dict.values():
+                            v['attributes'] = {}
+
+                        if member_buffer is not None:
+                            member_buffer.seek(0)
+                            processed = parse_xml(member_buffer, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
+                        else:
+                            with zip_file.extractfile(member) as xml_file:
+                                processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
                 else:
                     with zip_file.extractfile(member) as xml_file:
-                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
+                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
 
         elif input_file.endswith(".zip"):
             zip_file = ZipFile(input_file, 'r')
@@ -396,69 +608,280 @@ def parse_file(input_file, output_file, xsd_file, output_format, zip, xpath=None
 
             for i in range(len(zip_file_list)):
                 if xpath_list:
-                    if root is None:
+                    member_buffer = None
+                    if not has_parent_path:
                         parent_xpath_list = xpath_list[:-1]
                         with zip_file.open(zip_file_list[i].filename) as xml_file:
-                            root, parent = parse_root(xml_file, parent_xpath_list)
-                    if root is not None:
-                        if attribpaths:
-                            for k, v in attribpaths_dict.items():
-                                attribpaths_dict[k]['attributes'] = {}
-                                if v['root'] is None:
-                                    parent_xpath_list = list(k)[:-1]
-                                    with zip_file.open(zip_file_list[i].filename) as xml_file:
-                                        attribpaths_dict[k]['root'], attribpaths_dict[k]['parent'] = parse_root(xml_file, parent_xpath_list)
-
-                        with zip_file.open(zip_file_list[i].filename) as xml_file:
-                            processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
+                            if zip_file_list[i].file_size <= _MAX_MEMBER_BUFFER_SIZE:
+                                # decompress the member only once for parse_root and parse_xml
+                                member_buffer = io.BytesIO(xml_file.read())
+                                has_parent_path = parse_root(member_buffer, parent_xpath_list)
+                            else:
+                                has_parent_path = parse_root(xml_file, parent_xpath_list)
+                    if has_parent_path:
+                        for v in attribpaths_dict.values():
+                            v['attributes'] = {}
+
+                        if member_buffer is not None:
+                            member_buffer.seek(0)
+                            processed = parse_xml(member_buffer, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
+                        else:
+                            with zip_file.open(zip_file_list[i].filename) as xml_file:
+                                processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
                 else:
                     with zip_file.open(zip_file_list[i].filename) as xml_file:
-                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
+                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=True)
         
         elif input_file.endswith(".gz"):
-            if xpath_list:
-                if root is None:
+            with gzip.open(input_file) as xml_file:
+                if xpath_list:
                     parent_xpath_list = xpath_list[:-1]
-                    with gzip.open(input_file) as xml_file:
-                        root, parent = parse_root(xml_file, parent_xpath_list)
-
-                if root is not None:
-                    if attribpaths:
-                        for k, v in attribpaths_dict.items():
-                            parent_xpath_list = list(k)[:-1]
-                            with gzip.open(input_file) as xml_file:
-                                attribpaths_dict[k]['root'], attribpaths_dict[k]['parent'] = parse_root(xml_file, parent_xpath_list)
-                    
-                    with gzip.open(input_file) as xml_file:
-                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
-            else:
-                with gzip.open(input_file) as xml_file:
-                    processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
+                    has_parent_path = parse_root(xml_file, parent_xpath_list)
 
-        else:
-            if input_file == '-':
-                _input_file = sys.stdin
-            else:
-                _input_file = input_file
+                    if has_parent_path:
+                        # rewind instead of reopening, parse_root usually stops early in the file
+                        xml_file.seek(0)
+                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
+                else:
+                    processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
 
+        elif input_file == '-':
             if xpath_list:
-                if root is None:
+                # stdin can't be rewound, spool it to read it twice
+                with tempfile.SpooledTemporaryFile(max_size=_MAX_MEMBER_BUFFER_SIZE) as xml_file:
+                    shutil.copyfileobj(sys.stdin.buffer, xml_file)
+                    xml_file.seek(0)
                     parent_xpath_list = xpath_list[:-1]
-                    root, parent = parse_root(input_file, parent_xpath_list)
+                    has_parent_path = parse_root(xml_file, parent_xpath_list)
+
+                    if has_parent_path:
+                        xml_file.seek(0)
+                        processed = parse_xml(xml_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
+            else:
+                processed = parse_xml(sys.stdin.buffer, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
 
-                if root is not None:
-                    if attribpaths:
-                        for k, v in attribpaths_dict.items():
-                            parent_xpath_list = list(k)[:-1]
-                            attribpaths_dict[k]['root'], attribpaths_dict[k]['parent'] = parse_root(input_file, parent_xpath_list)
+        else:
+            if xpath_list:
+                parent_xpath_list = xpath_list[:-1]
+                has_parent_path = parse_root(input_file, parent_xpath_list)
 
-                    processed = parse_xml(_input_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
+                if has_parent_path:
+                    processed = parse_xml(input_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
             else:
-                processed = parse_xml(_input_file, json_file, my_schema, output_format, xpath_list, root, parent, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
+                processed = parse_xml(input_file, json_file, my_schema, output_format, xpath_list, xsd_elem, attribpaths_dict, excludepaths_set, excludeparents_set, elem_active, processed, from_zip=False)
 
         if input_file.endswith((".zip", ".tar.gz")) and output_format == "json":
-            json_file.write(bytes(os.linesep + "]", "utf-8"))
+            json_file.write(_JSON_ARRAY_END)
+
+    finish_file(input_file, output_file, processed, target_path, server, delete_xml)
+
+
+class PartitionReader(io.RawIOBase):
+    """
+    Reads a partition of records of an xml file as a well-formed xml document:
+    the document head up to the first record, the partition and the closing tags of its parents.
+    """
+
+    def __init__(self, xml_file, head_end, start, end, tail):
+        """
+        :param xml_file: xml file opened in binary mode
+        :param head_end: offset of the first record
+        :param start: offset of the partition
+        :param end: end offset of the partition
+        :param tail: closing tags of the record parents
+        """
+        super(PartitionReader, self).__init__()
+        self.xml_file = xml_file
+        self.ranges = [(0, head_end), (start, end)]
+        self.tail = tail
+
+    def readable(self):
+        """
+        :return: Returns back readable property of this reader
+        """
+        return True
+
+    def readinto(self, buffer):
+        """
+        :param buffer: buffer to fill
+        :return: number of bytes read
+        """
+        while self.ranges:
+            pos, end = self.ranges[0]
+            if pos < end:
+                self.xml_file.seek(pos)
+                size = self.xml_file.readinto(memoryview(buffer)[:end - pos])
+                if size:
+                    self.ranges[0] = (pos + size, end)
+                    return size
+            del self.ranges[0]
+        size = min(len(buffer), len(self.tail))
+        buffer[:size] = self.tail[:size]
+        self.tail = self.tail[size:]
+        return size
+
+
+def find_partitions(input_file, xpath_list, parts):
+    """
+    :param input_file: xml file
+    :param xpath_list: xpath in array format
+    :param parts: number of partitions
+    :return: offset of the first record, start offsets of the partitions and closing tags of the record parents
+             or None if no record is found
+    """
+    tag = xpath_list[-1].encode("utf-8")
+    record_start = re.compile(rb"<(?:[A-Za-z_][\w.-]*:)?" + re.escape(tag) + rb"[\s/>]")
+
+    with open(input_file, "rb") as xml_file, mmap.mmap(xml_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # find the first record below the parent xpath
+        parser = ET.XMLPullParser(events=("start", "end"), huge_tree=True, resolve_entities=False)
+        parents = []
+        head_end = None
+        pos = 0
+        for match in record_start.finditer(data):
+            parser.feed(data[pos:match.start()])
+            pos = match.start()
+            for event, elem in parser.read_events():
+                if event == "start":
+                    parents.append(elem)
+                else:
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+                    del parents[-1]
+            if [elem.tag.rpartition('}')[2] for elem in parents] == xpath_list[:-1]:
+                head_end = pos
+                break
+        if head_end is None:
+            return None
+
+        # split the records into partitions of about the same size
+        starts = [head_end]
+        for i in range(1, parts):
+            match = record_start.search(data, max(starts[-1] + 1, head_end + (len(data) - head_end) * i // parts))
+            if match is None:
+                break
+            starts.append(match.start())
+
+    tail = "".join("</" + (elem.prefix + ":" if elem.prefix else "") + elem.tag.rpartition('}')[2] + ">" for elem in reversed(parents))
+    return head_end, starts, tail.encode("utf-8")
+
+
+def _parse_partition(args):
+    """
+    :param args: tuple of input file, first record offset, partition offsets, closing tags, json part file, xsd file, output format, xpath and excludepaths
+    :return: data found and processed
+    :raises ValueError: xml partition could not be parsed
+    """
+    input_file, head_end, start, end, tail, part_file, xsd_file, output_format, xpath, excludepaths = args
+
+    my_schema = get_schema(xsd_file)
+    xpath_key, attribpaths_keys, excludepaths_set, excludeparents_set = parse_paths(xpath, None, excludepaths)
+    xsd_elem = find_xsd_elem(my_schema, xpath)
 
+    try:
+        with open(input_file, "rb") as xml_file, open(part_file, "wb", buffering=_BUFFER_SIZE) as json_file:
+            return parse_xml(PartitionReader(xml_file, head_end, start, end, tail), json_file, my_schema, output_format, list(xpath_key), xsd_elem, dict(), excludepaths_set, excludeparents_set, False, False, from_zip=True)
+    except ET.LxmlError as ex:
+        # lxml errors can't be pickled back to the parent process
+        raise ValueError(input_file + ": " + str(ex)) from None
+
+
+def parse_file_parallel(input_file, output_file, xsd_file, output_format, zip, xpath=None, attribpaths=None, excludepaths=None, target_path=None, server=None, delete_xml=None, multi=2):
+    """
+    Splits a large xml file at the records of xpath into partitions parsed concurrently.
+    Falls back to parse_file if the file can't be split.
+
+    :param input_file: input file
+    :param output_file: output file
+    :param xsd_file: xsd file
+    :param output_format: jsonl or json
+    :param zip: zip save file
+    :param xpath: whether to parse a specific xml path
+    :param attribpaths: paths to capture attributes when used with xpath
+    :param excludepaths: paths to exclude
+    :param target_path: directory to save file
+    :param server: optional server with hadoop client installed if current server does not have hadoop installed
+    :param delete_xml: optional delete xml file after converting
+    :param multi: how many partitions to parse concurrently
+    """
+    partitions = None
+    xpath_list = xpath.split("/")[1:] if xpath else []
+
+    # attributes of attribpaths could change between records, so these files are parsed as a whole
+    if len(xpath_list) > 1 and not attribpaths and input_file != '-' and not input_file.endswith((".gz", ".zip")) \
+            and os.path.getsize(input_file) >= _MIN_PARTITION_SIZE:
+        # the records of the partitions are merged using the xsd element of xpath,
+        # if it can't be resolved parse_file reports the error
+        try:
+            xsd_elem = find_xsd_elem(get_schema(xsd_file), xpath)
+        except Exception:
+            xsd_elem = None
+        if xsd_elem is not None:
+            partitions = find_partitions(input_file, xpath_list, multi)
+
+    parse_file_args = (input_file, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths, target_path, server, delete_xml)
+
+    if not partitions or len(partitions[1]) < 2:
+        error = _parse_file_star(parse_file_args)
+        if error:
+            _logger.info(error)
+        return
+
+    head_end, starts, tail = partitions
+    ends = starts[1:] + [os.path.getsize(input_file)]
+
+    _logger.debug("Parsing " + input_file + " in " + str(len(starts)) + " partitions")
+
+    _logger.debug("Writing to file " + output_file)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as part_dir:
+        part_files = [os.path.join(part_dir, str(i) + ".part") for i in range(len(starts))]
+        # the last partition ends with the original closing tags of the document
+        partition_args = [(input_file, head_end, starts[i], ends[i], tail if i < len(starts) - 1 else b"", part_files[i], xsd_file, output_format, xpath, excludepaths) for i in range(len(starts))]
+
+        try:
+            with Pool(processes=multi, initializer=_init_worker, initargs=(xsd_file,)) as parse_queue_pool:
+                results = parse_queue_pool.map(_parse_partition, partition_args)
+        except Exception as ex:
+            _logger.info(ex)
+            _logger.info("Could not parse " + input_file + " in partitions, parsing it as a whole")
+            error = _parse_file_star(parse_file_args)
+            if error:
+                _logger.info(error)
+            return
+
+        is_array = output_format == "json" and not xsd_elem.is_single()
+        record_sep = _SEP_JSON if output_format == "json" else _SEP_JSONL
+        processed = False
+
+        with open_file(zip, output_file) as json_file:
+            for i in range(len(part_files)):
+                if not results[i]:
+                    continue
+                if not processed:
+                    processed = True
+                    if is_array:
+                        json_file.write(_JSON_ARRAY_START)
+                else:
+                    json_file.write(record_sep)
+                with open(part_files[i], "rb") as part_file:
+                    shutil.copyfileobj(part_file, json_file, _BUFFER_SIZE)
+            if processed and is_array:
+                json_file.write(_JSON_ARRAY_END)
+
+    finish_file(input_file, output_file, processed, target_path, server, delete_xml)
+
+
+def finish_file(input_file, output_file, processed, target_path=None, server=None, delete_xml=None):
+    """
+    :param input_file: input file
+    :param output_file: output file
+    :param processed: data found and processed
+    :param target_path: directory to save file
+    :param server: optional server with hadoop client installed if current server does not have hadoop installed
+    :param delete_xml: optional delete xml file after converting
+    """
     # Remove file if no json is generated
     if not processed:
         os.remove(output_file)
@@ -541,15 +964,17 @@ def convert_xml_to_json(xsd_file=None, output_format="jsonl", server=None, targe
     file_list = list(set([f for _files in [('-' if xml_files[x] == '-' else glob.glob(xml_files[x])) for x in range(0, len(xml_files))] for f in _files]))
     file_count = len(file_list)
 
-    if multi > 1:
-        parse_queue_pool = Pool(processes=multi)
-
     _logger.info("Processing " + str(file_count) + " files")
 
-    if 1 < len(file_list) <= 1000:
-        file_list.sort(key=os.path.getsize, reverse=True)
+    if multi > 1 and len(file_list) > 1:
+        file_list.sort(key=lambda f: 0 if f == '-' else os.path.getsize(f), reverse=True)
         _logger.info("Parsing files in the following order:")
-        _logger.info(file_list)
+        if len(file_list) > 2 * _LOG_FILE_LIST_SIZE:
+            _logger.info(file_list[:_LOG_FILE_LIST_SIZE] + ["..."] + file_list[-_LOG_FILE_LIST_SIZE:])
+        else:
+            _logger.info(file_list)
+
+    parse_file_args = []
 
     for filename in file_list:
 
@@ -598,10 +1023,16 @@ def convert_xml_to_json(xsd_file=None, output_format="jsonl", server=None, targe
                     continue
 
         if multi > 1:
-            parse_queue_pool.apply_async(parse_file, args=(filename, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths, target_path, server, delete_xml), error_callback=_logger.info)
+            parse_file_args.append((filename, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths, target_path, server, delete_xml))
         else:
             parse_file(filename, output_file, xsd_file, output_format, zip, xpath, attribpaths, excludepaths, target_path, server, delete_xml)
 
-    if multi > 1:
-        parse_queue_pool.close()
-        parse_queue_pool.join()
+    if multi > 1 and len(parse_file_args) == 1:
+        # a single file is split into partitions which are parsed concurrently
+        parse_file_parallel(*parse_file_args[0], multi=multi)
+    elif multi > 1 and parse_file_args:
+        # files are dispatched one by one, largest files first
+        with Pool(processes=multi, initializer=_init_worker, initargs=(xsd_file,), maxtasksperchild=_MAX_TASKS_PER_CHILD) as parse_queue_pool:
+            for error in parse_queue_pool.imap_unordered(_parse_file_star, parse_file_args):
+                if error:
+                    _logger.info(error)